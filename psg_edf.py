@@ -1,8 +1,11 @@
 import os
 import re
 import json
+import operator
 import concurrent.futures
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 from threading import Lock
 import mne
 import numpy as np
@@ -20,25 +23,139 @@ CONFIG = {
 	}
 }
 
+UUID_RE = re.compile(r'([a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12})')
+ECG_CHANNEL_RE = re.compile(r'ecg|ekg|electrocardiogram', re.IGNORECASE)
+SPO2_CHANNEL_RE = re.compile(r'spo2|sao2|sat', re.IGNORECASE)
+RESP_CHANNEL_RE = re.compile(r'resp|breath|дыхание|thorax|chest|abdomen|flow|rip|pleth', re.IGNORECASE)
+
+STAGE_LABELS = {
+	'Sleep stage W(eventUnknown)': 'Wake',
+	'Sleep stage 1(eventUnknown)': 'N1',
+	'Sleep stage 2(eventUnknown)': 'N2',
+	'Sleep stage 3(eventUnknown)': 'N3',
+	'Sleep stage R(eventUnknown)': 'REM',
+	'Sleep stage Unknown(eventUnknown)': 'Unknown'
+}
+SLEEP_STAGES = tuple(STAGE_LABELS.values())
+STAGE_IDX = {stage: i for i, stage in enumerate(SLEEP_STAGES)}
+
+_STAGE_KEYS = np.array(sorted(STAGE_LABELS))
+_STAGE_KEY_CODES = np.array([STAGE_IDX[STAGE_LABELS[key]] for key in _STAGE_KEYS], dtype=np.int8)
+_STAGE_SYMBOLS = np.array(['W', 'N1', 'N2', 'N3', 'R'])
+_HYPNOGRAM_SYMBOLS = np.array(['W', '1', '2', '3', 'R'])
+
+_AnnotationArrays = namedtuple('_AnnotationArrays', ['desc', 'dur', 'counts', 'labels', 'inverse'])
+
+_STUDY_COLUMNS = frozenset(['artifact_count', 'artifact_duration_minutes'])
+
+def _annotation_key(annotations):
+	return (annotations.description, annotations.duration, annotations.onset)
+
+def _is_current(cached, annotations):
+	return cached is not None and all(a is b for a, b in zip(cached[0], _annotation_key(annotations)))
+
+def _annotation_arrays(raw):
+	annotations = raw.annotations
+	cached = getattr(raw, '_psg_annotation_cache', None)
+	if not _is_current(cached, annotations):
+		desc = np.array(list(annotations.description), dtype=str)
+		dur = np.asarray(annotations.duration, dtype=np.float64)
+		labels, inverse, counts = np.unique(desc, return_inverse=True, return_counts=True)
+		cached = (_annotation_key(annotations), _AnnotationArrays(desc, dur, dict(zip(labels.tolist(), counts.tolist())), labels, inverse))
+		raw._psg_annotation_cache = cached
+	return cached[1]
+
+def _channel_index(raw, name):
+	ch_names = raw.ch_names
+	cached = getattr(raw, '_psg_channel_index', None)
+	if cached is None or cached[0] is not ch_names or len(cached[1]) != len(ch_names):
+		cached = (ch_names, {ch: i for i, ch in enumerate(ch_names)})
+		raw._psg_channel_index = cached
+	return cached[1][name]
+
+def _stage_codes(raw):
+	annotations = raw.annotations
+	cached = getattr(raw, '_psg_stage_codes', None)
+	if not _is_current(cached, annotations):
+		arrays = _annotation_arrays(raw)
+		pos = np.minimum(np.searchsorted(_STAGE_KEYS, arrays.labels), len(_STAGE_KEYS) - 1)
+		label_codes = np.where(_STAGE_KEYS[pos] == arrays.labels, _STAGE_KEY_CODES[pos], -1).astype(np.int8)
+		codes = np.where(np.abs(arrays.dur - 30) < 1, label_codes[arrays.inverse], -1).astype(np.int8)
+		codes.flags.writeable = False
+		cached = (_annotation_key(annotations), codes)
+		raw._psg_stage_codes = cached
+	return cached[1]
+
+def _scored_stage_codes(raw):
+	codes = _stage_codes(raw)
+	return codes[(codes >= 0) & (codes < STAGE_IDX['Unknown'])]
+
+@lru_cache(maxsize=32)
+def _bandpass_sos(order, low, high, sfreq):
+	sos = signal.butter(order, [low / (sfreq / 2), high / (sfreq / 2)], btype='band', output='sos')
+	return sos.astype(np.float32)
+
+def _ladder_points(value, weights, reached):
+	return next((points for threshold, points in weights.items() if reached(value, threshold)), 0)
+
+def _block_argmax(x, starts, ends):
+	lengths = ends - starts
+	offsets = np.cumsum(lengths) - lengths
+	idx = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+	values = x[idx]
+	block_max = np.maximum.reduceat(values, offsets)
+	hits = np.flatnonzero(values == np.repeat(block_max, lengths))
+	_, first = np.unique(np.repeat(np.arange(len(starts)), lengths)[hits], return_index=True)
+	return idx[hits[first]]
+
+def _interval_mask(starts, ends, n):
+	starts = np.maximum(starts, 0)
+	nonempty = ends > starts
+	delta = np.zeros(n + 1, dtype=np.int32)
+	np.add.at(delta, starts[nonempty], 1)
+	np.add.at(delta, ends[nonempty], -1)
+	return np.cumsum(delta[:-1]) > 0
+
+def _moving_average(x, window):
+	padded = np.pad(x, (window // 2, window - 1 - window // 2), mode='edge')
+	csum = np.cumsum(np.insert(padded, 0, 0.0), dtype=np.float64)
+	return (csum[window:] - csum[:-window]) / window
+
 class ArtifactProcessor:
 	def get_artifact_mask(self, raw, artifact_marker='Артефакт(blockArtefact)'):
 		if not raw or not hasattr(raw, 'annotations'):
 			return None, []
 
+		annotations = raw.annotations
+		cached = getattr(raw, '_psg_artifact_mask', None)
+		if not _is_current(cached, annotations) or cached[1] != artifact_marker:
+			valid_mask, artifact_regions = self._build_artifact_mask(raw, artifact_marker)
+			if valid_mask is not None:
+				valid_mask.flags.writeable = False
+			cached = (_annotation_key(annotations), artifact_marker, valid_mask, artifact_regions)
+			raw._psg_artifact_mask = cached
+		return cached[2], list(cached[3])
+
+	def _build_artifact_mask(self, raw, artifact_marker):
 		sfreq = raw.info['sfreq']
 		total_samples = len(raw.times)
-		valid_mask = np.ones(total_samples, dtype=bool)
-		artifact_regions = []
 
-		for desc, onset, duration in zip(raw.annotations.description, raw.annotations.onset, raw.annotations.duration):
-			if artifact_marker in str(desc):
-				start = int(onset * sfreq)
-				end = min(int((onset + duration) * sfreq), total_samples)
-				if start < total_samples:
-					valid_mask[start:end] = False
-					artifact_regions.append({'start_time': onset, 'end_time': onset + duration, 'duration': duration})
+		arrays = _annotation_arrays(raw)
+		is_artifact = np.char.find(arrays.desc, artifact_marker) >= 0
+		onsets, durations = raw.annotations.onset[is_artifact], arrays.dur[is_artifact]
+		starts = (onsets * sfreq).astype(np.int64)
+		inside = starts < total_samples
+		onsets, durations, starts = onsets[inside], durations[inside], starts[inside]
+		ends = np.minimum(((onsets + durations) * sfreq).astype(np.int64), total_samples)
+
+		artifact_regions = [{'start_time': onset, 'end_time': onset + duration, 'duration': duration}
+		                    for onset, duration in zip(onsets, durations)]
 
 		gap_mask, gap_regions = self.get_heartbeat_gaps(raw)
+		if not artifact_regions and gap_mask is None:
+			return None, []
+
+		valid_mask = ~_interval_mask(starts, ends, total_samples)
 		if gap_mask is not None:
 			valid_mask &= ~gap_mask
 			artifact_regions.extend(gap_regions)
@@ -49,34 +166,29 @@ class ArtifactProcessor:
 		if not raw or not hasattr(raw, 'annotations'):
 			return None, []
 
-		annotations = raw.annotations
+		desc = _annotation_arrays(raw).desc
 		sfreq = raw.info['sfreq']
 		total_samples = len(raw.times)
 
-		times = annotations.onset[annotations.description == marker]
+		times = raw.annotations.onset[desc == marker]
 		if len(times) < 2:
 			return None, []
 
-		gap_mask = np.zeros(total_samples, dtype=bool)
-		gap_regions = []
-
 		intervals = np.diff(times)
-		gap_indices = np.where(intervals > max_gap)[0]
-
-		for idx in gap_indices:
-			start_time = times[idx]
-			end_time = times[idx + 1]
-			duration = intervals[idx]
-
-			if duration >= min_duration:
-				start_sample = int(start_time * sfreq)
-				end_sample = min(int(end_time * sfreq), total_samples)
-				if start_sample < total_samples:
-					gap_mask[start_sample:end_sample] = True
-					gap_regions.append({
-						'start_time': start_time, 'end_time': end_time,
-						'duration': duration, 'type': 'heartbeat_gap'
-					})
+		is_gap = (intervals > max_gap) & (intervals >= min_duration)
+		start_times, end_times, durations = times[:-1][is_gap], times[1:][is_gap], intervals[is_gap]
+		starts = (start_times * sfreq).astype(np.int64)
+		inside = starts < total_samples
+		start_times, end_times, durations, starts = start_times[inside], end_times[inside], durations[inside], starts[inside]
+		if len(starts) == 0:
+			return None, []
+		ends = np.minimum((end_times * sfreq).astype(np.int64), total_samples)
+
+		gap_mask = _interval_mask(starts, ends, total_samples)
+		gap_regions = [{
+			'start_time': start_time, 'end_time': end_time,
+			'duration': duration, 'type': 'heartbeat_gap'
+		} for start_time, end_time, duration in zip(start_times, end_times, durations)]
 
 		return gap_mask, gap_regions
 
@@ -91,28 +203,25 @@ class SignalAnalyzer:
 
 		try:
 			if raw and hasattr(raw, 'annotations'):
-				for desc in raw.annotations.description:
-					desc_str = str(desc)
-					if 'Тахикардия' in desc_str:
-						results['tachycardia_events'] += 1
-					elif 'Брадикардия' in desc_str:
-						results['bradycardia_events'] += 1
-
-			ecg_channels = [ch for ch in raw.ch_names if
-			                any(kw in ch.lower() for kw in ['ecg', 'ekg', 'electrocardiogram'])]
+				counts = _annotation_arrays(raw).counts
+				for label, count in counts.items():
+					if 'Тахикардия' in label:
+						results['tachycardia_events'] += count
+					elif 'Брадикардия' in label:
+						results['bradycardia_events'] += count
+
+			ecg_channels = [ch for ch in raw.ch_names if ECG_CHANNEL_RE.search(ch)]
 			if not ecg_channels:
 				return results
 
 			artifact_mask, _ = self.artifact_processor.get_artifact_mask(raw)
-			ecg_idx = raw.ch_names.index(ecg_channels[0])
+			ecg_idx = _channel_index(raw, ecg_channels[0])
 			sfreq = raw.info['sfreq']
 
-			data, _ = raw[ecg_idx, :]
-			if len(data) == 0:
+			ecg_signal = np.ascontiguousarray(raw.get_data(picks=[ecg_idx])[0], dtype=np.float32)
+			if len(ecg_signal) == 0:
 				return results
 
-			ecg_signal = data[0]
-
 			if artifact_mask is not None:
 				ecg_signal = ecg_signal[artifact_mask[:len(ecg_signal)]]
 				if len(ecg_signal) == 0:
@@ -129,10 +238,11 @@ class SignalAnalyzer:
 					valid_hr = hr[(hr >= cfg['hr_min']) & (hr <= cfg['hr_max'])]
 
 					if len(valid_hr) > 5:
+						median_hr, low_hr, high_hr = np.percentile(valid_hr, [50, 5, 95])
 						results.update({
-							'avg_heart_rate': round(float(np.median(valid_hr)), 2),
-							'min_heart_rate': round(float(np.percentile(valid_hr, 5)), 2),
-							'max_heart_rate': round(float(np.percentile(valid_hr, 95)), 2),
+							'avg_heart_rate': round(float(median_hr), 2),
+							'min_heart_rate': round(float(low_hr), 2),
+							'max_heart_rate': round(float(high_hr), 2),
 							'heart_rate_variability': round(float(np.std(valid_rr * 1000)), 2)
 						})
 
@@ -143,23 +253,34 @@ class SignalAnalyzer:
 
 	def detect_r_peaks(self, ecg_signal, sfreq):
 		try:
-			ecg_clean = ecg_signal - np.median(ecg_signal)
+			ecg_clean = (ecg_signal - np.median(ecg_signal)).astype(np.float32, copy=False)
 
 			if len(ecg_clean) > 100:
-				b, a = signal.butter(3, [5 / (sfreq / 2), 35 / (sfreq / 2)], btype='band')
-				ecg_filtered = signal.filtfilt(b, a, ecg_clean)
+				ecg_filtered = signal.sosfiltfilt(_bandpass_sos(3, 8, 20, sfreq), ecg_clean)
 			else:
 				ecg_filtered = ecg_clean
 
 			ecg_squared = np.square(ecg_filtered)
-			window_size = int(0.1 * sfreq)
-			if window_size % 2 == 0:
-				window_size += 1
+			qrs_window = max(int(0.12 * sfreq), 1)
+			beat_window = max(int(0.6 * sfreq), 1)
+
+			ma_qrs = _moving_average(ecg_squared, qrs_window)
+			ma_beat = _moving_average(ecg_squared, beat_window)
+			blocks = ma_qrs > ma_beat + 0.08 * np.mean(ecg_squared)
 
-			ecg_smoothed = signal.medfilt(ecg_squared, kernel_size=window_size)
+			edges = np.diff(blocks.astype(np.int8), prepend=0, append=0)
+			starts = np.flatnonzero(edges == 1)
+			ends = np.flatnonzero(edges == -1)
+			keep = (ends - starts) >= qrs_window
+			if not np.any(keep):
+				return np.array([], dtype=int)
 
-			threshold = np.percentile(ecg_smoothed, 85)
-			peaks, _ = signal.find_peaks(ecg_smoothed, height=threshold, distance=int(0.3 * sfreq))
+			ecg_abs = np.abs(ecg_filtered)
+			candidates = _block_argmax(ecg_abs, starts[keep], ends[keep])
+
+			impulses = np.zeros(len(ecg_abs))
+			impulses[candidates] = ecg_abs[candidates]
+			peaks, _ = signal.find_peaks(impulses, height=0, distance=max(int(0.25 * sfreq), 1))
 
 			return peaks
 		except Exception as e:
@@ -171,47 +292,30 @@ class SignalAnalyzer:
 		         'time_below_spo2_85': 0}
 
 		try:
-			artifact_mask, artifact_regions = self.artifact_processor.get_artifact_mask(raw)
+			artifact_mask, _ = self.artifact_processor.get_artifact_mask(raw)
 			cfg = self.config['spo2']
 
-			spo2_channels = [ch for ch in raw.ch_names if any(x in ch.lower() for x in ['spo2', 'sao2', 'sat'])]
+			spo2_channels = [ch for ch in raw.ch_names if SPO2_CHANNEL_RE.search(ch)]
 			if spo2_channels:
-				spo2_idx = raw.ch_names.index(spo2_channels[0])
-				data, _ = raw[spo2_idx, :]
-				if len(data) > 0:
-					spo2_values = data[0]
-
+				spo2_idx = _channel_index(raw, spo2_channels[0])
+				spo2_values = raw.get_data(picks=[spo2_idx])[0]
+				if len(spo2_values) > 0:
+					valid = (spo2_values >= cfg['min_valid']) & (spo2_values <= cfg['max_valid'])
 					if artifact_mask is not None:
-						valid_spo2 = spo2_values[(spo2_values >= cfg['min_valid']) &
-						                         (spo2_values <= cfg['max_valid']) & artifact_mask]
-					else:
-						valid_spo2 = spo2_values[(spo2_values >= cfg['min_valid']) &
-						                         (spo2_values <= cfg['max_valid'])]
+						valid &= artifact_mask
 
+					valid_spo2 = spo2_values[valid]
 					if len(valid_spo2) > 0:
-						stats['avg_spo2'] = round(float(np.median(valid_spo2)), 1)
-						stats['min_spo2'] = round(float(np.percentile(valid_spo2, 1)), 1)
-						stats['spo2_baseline'] = round(float(np.percentile(valid_spo2, 90)), 1)
-
-						if artifact_mask is not None:
-							total_valid = np.sum(artifact_mask)
-							if total_valid > 0:
-								below_90 = np.sum((spo2_values < cfg['threshold_90']) & artifact_mask &
-								                  (spo2_values >= cfg['min_valid']) & (spo2_values <= cfg['max_valid']))
-								below_85 = np.sum((spo2_values < cfg['threshold_85']) & artifact_mask &
-								                  (spo2_values >= cfg['min_valid']) & (spo2_values <= cfg['max_valid']))
-
-								total_duration = raw.times[-1]
-								valid_ratio = total_valid / len(raw.times)
-
-								if total_valid > 0:
-									stats['time_below_spo2_90'] = int(
-										(below_90 / total_valid) * (total_duration / 60) * valid_ratio)
-									stats['time_below_spo2_85'] = int(
-										(below_85 / total_valid) * (total_duration / 60) * valid_ratio)
-								else:
-									stats['time_below_spo2_90'] = 0
-									stats['time_below_spo2_85'] = 0
+						median, p1, p90 = np.percentile(valid_spo2, [50, 1, 90])
+						stats['avg_spo2'] = round(float(median), 1)
+						stats['min_spo2'] = round(float(p1), 1)
+						stats['spo2_baseline'] = round(float(p90), 1)
+
+						sfreq = raw.info['sfreq']
+						below_90 = np.count_nonzero(valid_spo2 < cfg['threshold_90'])
+						below_85 = np.count_nonzero(valid_spo2 < cfg['threshold_85'])
+						stats['time_below_spo2_90'] = int(below_90 / sfreq / 60)
+						stats['time_below_spo2_85'] = int(below_85 / sfreq / 60)
 
 		except Exception as e:
 			print(f"SpO2 analysis error: {e}")
@@ -223,7 +327,8 @@ class SignalAnalyzer:
 			if len(resp_signal) < int(sfreq * 20):
 				return []
 
-			normalized = (resp_signal - np.mean(resp_signal)) / (np.std(resp_signal) + 1e-8)
+			normalized = resp_signal - np.mean(resp_signal)
+			normalized /= np.std(resp_signal) + 1e-8
 			min_distance = int(0.6 * sfreq)
 
 			peaks, properties = signal.find_peaks(
@@ -271,15 +376,13 @@ class SignalAnalyzer:
 	def analyze_resp_channel(self, raw, channel_name):
 		try:
 			artifact_mask, _ = self.artifact_processor.get_artifact_mask(raw)
-			ch_idx = raw.ch_names.index(channel_name)
+			ch_idx = _channel_index(raw, channel_name)
 			sfreq = raw.info['sfreq']
 
-			data, _ = raw[ch_idx, :]
-			if len(data) == 0:
+			resp_signal = np.ascontiguousarray(raw.get_data(picks=[ch_idx])[0], dtype=np.float32)
+			if len(resp_signal) == 0:
 				return []
 
-			resp_signal = data[0]
-
 			if artifact_mask is not None and len(artifact_mask) == len(resp_signal):
 				resp_signal = resp_signal[artifact_mask]
 				if len(resp_signal) == 0:
@@ -301,16 +404,13 @@ class SignalAnalyzer:
 			signal_std = np.std(cleaned)
 			if signal_std < 1e-8:
 				return None
-			normalized = cleaned / signal_std
+			normalized = cleaned.astype(np.float32, copy=False)
+			normalized /= signal_std
 
 			cfg = self.config['respiration']
-			low_freq = cfg['filter_low'] / (sfreq / 2)
-			high_freq = cfg['filter_high'] / (sfreq / 2)
-
-			if low_freq >= 1.0 or high_freq >= 1.0:
+			if cfg['filter_low'] >= sfreq / 2 or cfg['filter_high'] >= sfreq / 2:
 				return normalized
-			b, a = signal.butter(3, [low_freq, high_freq], btype='band')
-			filtered = signal.filtfilt(b, a, normalized)
+			filtered = signal.sosfiltfilt(_bandpass_sos(3, cfg['filter_low'], cfg['filter_high'], sfreq), normalized)
 
 			return filtered
 
@@ -322,17 +422,16 @@ class SignalAnalyzer:
 		stats = {'avg_resp_rate': None, 'min_resp_rate': None, 'max_resp_rate': None}
 
 		try:
-			resp_keywords = ['resp', 'breath', 'дыхание', 'thorax', 'chest', 'abdomen', 'flow', 'rip', 'pleth']
-			resp_channels = [ch for ch in raw.ch_names if any(p in ch.lower() for p in resp_keywords)]
+			resp_channels = [ch for ch in raw.ch_names if RESP_CHANNEL_RE.search(ch)]
 
 			if not resp_channels:
 				return stats
 
 			best_rates = []
-			for ch in resp_channels[:3]:
-				rates = self.analyze_resp_channel(raw, ch)
-				if rates:
-					best_rates.extend(rates)
+			with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+				for rates in executor.map(lambda ch: self.analyze_resp_channel(raw, ch), resp_channels[:3]):
+					if rates:
+						best_rates.extend(rates)
 
 			if not best_rates:
 				return stats
@@ -358,10 +457,11 @@ class SignalAnalyzer:
 			final_rates = final_rates if len(final_rates) >= 3 else valid_rates
 
 			if len(final_rates) > 0:
+				median_rate, low_rate, high_rate = np.percentile(final_rates, [50, 10, 90])
 				stats.update({
-					'avg_resp_rate': round(float(np.median(final_rates)), 1),
-					'min_resp_rate': round(float(np.percentile(final_rates, 10)), 1),
-					'max_resp_rate': round(float(np.percentile(final_rates, 90)), 1)
+					'avg_resp_rate': round(float(median_rate), 1),
+					'min_resp_rate': round(float(low_rate), 1),
+					'max_resp_rate': round(float(high_rate), 1)
 				})
 
 		except Exception as e:
@@ -373,15 +473,23 @@ class SleepAnalyzer:
 	def __init__(self, config=None):
 		self.config = config or CONFIG
 		self.raw = None
+		self.raw_source = None
 		self.stages = None
+		self.stage_minutes = None
+		self.total_sleep_minutes = 0.0
 		self.signal_analyzer = SignalAnalyzer(self.config)
 		self.artifact_processor = ArtifactProcessor()
 
 	def load_edf(self, path):
 		try:
+			source = (os.path.abspath(path), os.path.getmtime(path))
+			if self.raw is not None and self.raw_source == source:
+				return self.raw
+
+			self.raw_source = None
 			self.raw = mne.io.read_raw_edf(
 				path,
-				preload=True,
+				preload=False,
 				verbose=False,
 				infer_types=True,
 				stim_channel=None
@@ -390,6 +498,7 @@ class SleepAnalyzer:
 			if hasattr(self.raw, 'annotations') and self.raw.annotations:
 				self._fix_annotations_out_of_bounds()
 
+			self.raw_source = source
 			return self.raw
 
 		except Exception as e:
@@ -432,10 +541,9 @@ class SleepAnalyzer:
 	def extract_uuid(self, path):
 		try:
 			with open(path, 'rb') as f:
-				header = f.read(256).decode('latin-1', errors='ignore')
-				patient_info = header[8:168].strip()
-				match = re.search(r'([a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12})',
-				                  patient_info)
+				f.seek(8)
+				patient_info = f.read(160).decode('latin-1', errors='ignore')
+				match = UUID_RE.search(patient_info)
 				return match.group(1) if match else None
 		except Exception as e:
 			print(f"UUID extract error {path}: {e}")
@@ -445,74 +553,71 @@ class SleepAnalyzer:
 		if not self.raw or not hasattr(self.raw, 'annotations'):
 			return None
 
-		annotations = self.raw.annotations
-		mapping = {
-			'Sleep stage W(eventUnknown)': 'Wake',
-			'Sleep stage 1(eventUnknown)': 'N1',
-			'Sleep stage 2(eventUnknown)': 'N2',
-			'Sleep stage 3(eventUnknown)': 'N3',
-			'Sleep stage R(eventUnknown)': 'REM',
-			'Sleep stage Unknown(eventUnknown)': 'Unknown'
-		}
+		codes = _stage_codes(self.raw)
+		counts = np.bincount(codes[codes >= 0], minlength=len(SLEEP_STAGES))
 
-		stages = {s: {'count': 0, 'minutes': 0} for s in ['Wake', 'N1', 'N2', 'N3', 'REM', 'Unknown']}
+		self.stage_minutes = counts * 0.5
+		self.total_sleep_minutes = float(self.stage_minutes[STAGE_IDX['N1']:STAGE_IDX['REM'] + 1].sum())
+		self.stages = {stage: {'count': int(counts[i]), 'minutes': float(self.stage_minutes[i])}
+		               for i, stage in enumerate(SLEEP_STAGES)}
+		return self.stages
 
-		for desc, duration in zip(annotations.description, annotations.duration):
-			desc_str = str(desc)
-			if desc_str in mapping and abs(duration - 30) < 1:
-				stage = mapping[desc_str]
-				stages[stage]['count'] += 1
-				stages[stage]['minutes'] += 0.5
+	def calculate_summary(self):
+		if not self.raw or not self.stages:
+			return {}
 
-		self.stages = stages
-		return stages
+		respiratory_events = self.calculate_respiratory_events() or {}
+		return {
+			'efficiency': self.calculate_efficiency() or {},
+			'architecture': self.calculate_architecture() or {},
+			'fragmentation': self.calculate_fragmentation() or {},
+			'respiratory_events': respiratory_events,
+			'sleep_indices': self.calculate_indices(respiratory_events) or {},
+			'rem_quality': self.calculate_rem_quality() or {},
+			'rem_cycles': self.calculate_rem_cycles()
+		}
 
 	def calculate_efficiency(self):
-		if not self.stages:
+		if self.stage_minutes is None:
 			return None
 
-		total_sleep = sum(self.stages[s]['minutes'] for s in ['N1', 'N2', 'N3', 'REM'])
-		total_bed = sum(s['minutes'] for s in self.stages.values())
+		total_sleep = self.total_sleep_minutes
+		total_bed = float(self.stage_minutes.sum())
 		efficiency = (total_sleep / total_bed * 100) if total_bed > 0 else 0
 
 		return {
 			'sleep_efficiency': efficiency,
 			'total_sleep_time': total_sleep,
 			'total_bed_time': total_bed,
-			'wake_after_sleep_onset': self.stages['Wake']['minutes']
+			'wake_after_sleep_onset': float(self.stage_minutes[STAGE_IDX['Wake']])
 		}
 
 	def calculate_architecture(self):
-		if not self.stages:
+		if self.stage_minutes is None:
 			return None
 
-		total_sleep = sum(self.stages[s]['minutes'] for s in ['N1', 'N2', 'N3', 'REM'])
+		total_sleep = self.total_sleep_minutes
 		if total_sleep == 0:
 			return None
 
+		percentages = self.stage_minutes / total_sleep * 100
 		return {
-			'n1_percentage': (self.stages['N1']['minutes'] / total_sleep) * 100,
-			'n2_percentage': (self.stages['N2']['minutes'] / total_sleep) * 100,
-			'n3_percentage': (self.stages['N3']['minutes'] / total_sleep) * 100,
-			'rem_percentage': (self.stages['REM']['minutes'] / total_sleep) * 100,
+			'n1_percentage': float(percentages[STAGE_IDX['N1']]),
+			'n2_percentage': float(percentages[STAGE_IDX['N2']]),
+			'n3_percentage': float(percentages[STAGE_IDX['N3']]),
+			'rem_percentage': float(percentages[STAGE_IDX['REM']]),
 		}
 
 	def calculate_latencies(self):
-		annotations = self.raw.annotations
-		first_sleep = first_rem = None
-		current_time = 0
-
-		for desc, duration in zip(annotations.description, annotations.duration):
-			desc_str = str(desc)
-			if desc_str in ['Sleep stage 1(eventUnknown)', 'Sleep stage 2(eventUnknown)',
-			                'Sleep stage 3(eventUnknown)', 'Sleep stage R(eventUnknown)']:
-				if first_sleep is None and abs(duration - 30) < 1:
-					first_sleep = current_time
+		dur = _annotation_arrays(self.raw).dur
+		codes = _stage_codes(self.raw)
+		onsets = np.zeros(len(dur))
+		np.cumsum(dur[:-1], out=onsets[1:])
 
-			if desc_str == 'Sleep stage R(eventUnknown)' and first_rem is None and abs(duration - 30) < 1:
-				first_rem = current_time
-
-			current_time += duration
+		sleep_mask = (codes >= STAGE_IDX['N1']) & (codes <= STAGE_IDX['REM'])
+		rem_mask = codes == STAGE_IDX['REM']
+		first_sleep = float(onsets[sleep_mask.argmax()]) if sleep_mask.any() else None
+		first_rem = float(onsets[rem_mask.argmax()]) if rem_mask.any() else None
 
 		rem_latency = (first_rem - first_sleep) / 60 if first_sleep and first_rem else None
 		return {
@@ -521,17 +626,14 @@ class SleepAnalyzer:
 		}
 
 	def calculate_fragmentation(self):
-		annotations = self.raw.annotations
+		counts = _annotation_arrays(self.raw).counts
 
-		activations = sum(
-			1 for desc in annotations.description if str(desc) == 'Активация(pointPolySomnographyActivation)')
-		limb_movements = sum(1 for desc in annotations.description if
-		                     str(desc) == 'Движение конечностей(pointPolySomnographyLegsMovements)')
-		periodic_movements = sum(1 for desc in annotations.description if
-		                         str(desc) == 'Периодические движения конечностей(pointPolySomnographyPeriodicalLegsMovements)')
-		bruxism = sum(1 for desc in annotations.description if str(desc) == 'Бруксизм(pointBruxism)')
+		activations = counts.get('Активация(pointPolySomnographyActivation)', 0)
+		limb_movements = counts.get('Движение конечностей(pointPolySomnographyLegsMovements)', 0)
+		periodic_movements = counts.get('Периодические движения конечностей(pointPolySomnographyPeriodicalLegsMovements)', 0)
+		bruxism = counts.get('Бруксизм(pointBruxism)', 0)
 
-		total_sleep = sum(self.stages[s]['minutes'] for s in ['N1', 'N2', 'N3', 'REM'])
+		total_sleep = self.total_sleep_minutes
 		total_movements = limb_movements + periodic_movements
 		fragmentation_index = (activations + total_movements) / (total_sleep / 60) if total_sleep > 0 else 0
 
@@ -546,7 +648,6 @@ class SleepAnalyzer:
 		}
 
 	def calculate_respiratory_events(self):
-		annotations = self.raw.annotations
 		mapping = {
 			'Обструктивное апноэ(pointPolySomnographyObstructiveApnea)': 'obstructive_apneas',
 			'Центральное апноэ(pointPolySomnographyCentralApnea)': 'central_apneas',
@@ -563,22 +664,22 @@ class SleepAnalyzer:
 		                         'hypopneas', 'obstructive_hypopneas', 'central_hypopneas', 'mixed_hypopneas',
 		                         'desaturations', 'snoring', 'cheyne_stokes']}
 
-		for desc in annotations.description:
-			desc_str = str(desc)
-			if desc_str in mapping:
-				events[mapping[desc_str]] += 1
+		counts = _annotation_arrays(self.raw).counts
+		for label, key in mapping.items():
+			events[key] += counts.get(label, 0)
 
 		events['apneas'] = events['obstructive_apneas'] + events['central_apneas'] + events['mixed_apneas']
 		events['hypopneas'] = events['obstructive_hypopneas'] + events['central_hypopneas'] + events['mixed_hypopneas']
 
 		return events
 
-	def calculate_indices(self):
+	def calculate_indices(self, respiratory_events=None):
 		if not self.raw or not self.stages:
 			return {}
 
-		respiratory_events = self.calculate_respiratory_events() or {}
-		total_sleep = sum(self.stages[s]['minutes'] for s in ['N1', 'N2', 'N3', 'REM'])
+		if respiratory_events is None:
+			respiratory_events = self.calculate_respiratory_events() or {}
+		total_sleep = self.total_sleep_minutes
 
 		if total_sleep == 0:
 			return {}
@@ -616,10 +717,9 @@ class SleepAnalyzer:
 		if not self.raw or not hasattr(self.raw, 'annotations'):
 			return None
 
-		annotations = self.raw.annotations
-		rem_epochs = sum(1 for desc, duration in zip(annotations.description, annotations.duration)
-		                 if str(desc) == 'Sleep stage R(eventUnknown)' and abs(duration - 30) < 1)
-		rem_events = sum(1 for desc in annotations.description if str(desc) == 'БДГ(pointPolySomnographyREM)')
+		counts = _annotation_arrays(self.raw).counts
+		rem_epochs = int(np.count_nonzero(_stage_codes(self.raw) == STAGE_IDX['REM']))
+		rem_events = counts.get('БДГ(pointPolySomnographyREM)', 0)
 
 		rem_minutes = rem_epochs * 0.5
 		rem_density = rem_events / rem_minutes if rem_minutes > 0 else 0
@@ -642,62 +742,38 @@ class SleepAnalyzer:
 		if not self.raw or not hasattr(self.raw, 'annotations'):
 			return 0
 
-		sequence = self.extract_stage_sequence()
-		if not sequence:
+		codes = _scored_stage_codes(self.raw)
+		if len(codes) == 0:
 			return 0
 
-		cycles = 0
-		in_rem_sequence = False
-
-		for i in range(len(sequence)):
-			if sequence[i] == 'R' and not in_rem_sequence:
-				in_rem_sequence = True
-			elif in_rem_sequence and sequence[i] in ['N1', 'N2', 'N3', 'W']:
-				cycles += 1
-				in_rem_sequence = False
-
-		return cycles
+		runs = codes[np.flatnonzero(np.diff(codes, prepend=-1))]
+		return int(np.count_nonzero(runs[:-1] == STAGE_IDX['REM']))
 
 	def extract_stage_sequence(self):
 		if not self.raw or not hasattr(self.raw, 'annotations'):
 			return []
 
-		mapping = {
-			'Sleep stage W(eventUnknown)': 'W',
-			'Sleep stage 1(eventUnknown)': 'N1',
-			'Sleep stage 2(eventUnknown)': 'N2',
-			'Sleep stage 3(eventUnknown)': 'N3',
-			'Sleep stage R(eventUnknown)': 'R'
-		}
-
-		sequence = []
-		for desc, duration in zip(self.raw.annotations.description, self.raw.annotations.duration):
-			desc_str = str(desc)
-			if desc_str in mapping and abs(duration - 30) < 1:
-				sequence.append(mapping[desc_str])
-
-		return sequence
+		return _STAGE_SYMBOLS[_scored_stage_codes(self.raw)].tolist()
 
-	def calculate_sleep_quality(self):
+	def calculate_sleep_quality(self, hr_stats=None, summary=None):
 		if not self.raw or not self.stages:
 			return {}
 
-		efficiency = self.calculate_efficiency() or {}
-		architecture = self.calculate_architecture() or {}
-		sleep_indices = self.calculate_indices() or {}
-		fragmentation = self.calculate_fragmentation() or {}
-		rem_quality = self.calculate_rem_quality() or {}
-		hr_stats = self.signal_analyzer.analyze_ecg(self.raw) or {}
-		rem_cycles = self.calculate_rem_cycles()
+		if summary is None:
+			summary = self.calculate_summary()
+		efficiency = summary['efficiency']
+		architecture = summary['architecture']
+		sleep_indices = summary['sleep_indices']
+		fragmentation = summary['fragmentation']
+		rem_quality = summary['rem_quality']
+		rem_cycles = summary['rem_cycles']
+		if hr_stats is None:
+			hr_stats = self.signal_analyzer.analyze_ecg(self.raw) or {}
 
 		score = 0
 		cfg = self.config['sleep_quality']
 
-		efficiency_val = efficiency.get('sleep_efficiency', 0)
-		for threshold, points in cfg['efficiency_weights'].items():
-			if efficiency_val >= threshold:
-				score += points
-				break
+		score += _ladder_points(efficiency.get('sleep_efficiency', 0), cfg['efficiency_weights'], operator.ge)
 
 		n3_percentage = architecture.get('n3_percentage', 0)
 		rem_percentage = architecture.get('rem_percentage', 0)
@@ -707,17 +783,8 @@ class SleepAnalyzer:
 		if rem_percentage >= cfg['rem_threshold']:
 			score += 15
 
-		ahi = sleep_indices.get('ahi', 0)
-		for threshold, points in cfg['ahi_weights'].items():
-			if ahi < threshold:
-				score += points
-				break
-
-		arousal_index = fragmentation.get('arousal_index', 0)
-		for threshold, points in cfg['arousal_weights'].items():
-			if arousal_index < threshold:
-				score += points
-				break
+		score += _ladder_points(sleep_indices.get('ahi', 0), cfg['ahi_weights'], operator.lt)
+		score += _ladder_points(fragmentation.get('arousal_index', 0), cfg['arousal_weights'], operator.lt)
 
 		rem_score = rem_quality.get('rem_quality_score', 0)
 		score += rem_score * 0.15
@@ -757,20 +824,7 @@ class SleepAnalyzer:
 		if not self.raw or not hasattr(self.raw, 'annotations'):
 			return None
 
-		annotations = self.raw.annotations
-		mapping = {
-			'Sleep stage W(eventUnknown)': 'W',
-			'Sleep stage 1(eventUnknown)': '1',
-			'Sleep stage 2(eventUnknown)': '2',
-			'Sleep stage 3(eventUnknown)': '3',
-			'Sleep stage R(eventUnknown)': 'R'
-		}
-
-		sequence = []
-		for desc, duration in zip(annotations.description, annotations.duration):
-			desc_str = str(desc)
-			if desc_str in mapping and abs(duration - 30) < 1:
-				sequence.append(mapping[desc_str])
+		sequence = _HYPNOGRAM_SYMBOLS[_scored_stage_codes(self.raw)].tolist()
 
 		return {'e': len(sequence), 'd': 30, 's': sequence}
 
@@ -779,21 +833,28 @@ class SleepAnalyzer:
 			return None
 
 		stages = self.calculate_stages() or {}
-		efficiency = self.calculate_efficiency() or {}
-		architecture = self.calculate_architecture() or {}
-		fragmentation = self.calculate_fragmentation() or {}
-		respiratory_events = self.calculate_respiratory_events() or {}
-		sleep_indices = self.calculate_indices() or {}
-		rem_quality = self.calculate_rem_quality() or {}
-		hr_stats = self.signal_analyzer.analyze_ecg(self.raw) or {}
-		spo2_stats = self.signal_analyzer.analyze_spo2(self.raw) or {}
-		resp_stats = self.signal_analyzer.analyze_respiration(self.raw) or {}
+		summary = self.calculate_summary()
+		efficiency = summary.get('efficiency', {})
+		architecture = summary.get('architecture', {})
+		fragmentation = summary.get('fragmentation', {})
+		respiratory_events = summary.get('respiratory_events', {})
+		sleep_indices = summary.get('sleep_indices', {})
+		rem_quality = summary.get('rem_quality', {})
+		_, artifact_regions = self.artifact_processor.get_artifact_mask(self.raw)
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+			hr_future = executor.submit(self.signal_analyzer.analyze_ecg, self.raw)
+			spo2_future = executor.submit(self.signal_analyzer.analyze_spo2, self.raw)
+			resp_future = executor.submit(self.signal_analyzer.analyze_respiration, self.raw)
+			hr_stats = hr_future.result() or {}
+			spo2_stats = spo2_future.result() or {}
+			resp_stats = resp_future.result() or {}
+
 		latencies = self.calculate_latencies() or {}
-		sleep_quality = self.calculate_sleep_quality() or {}
+		sleep_quality = self.calculate_sleep_quality(hr_stats, summary) or {}
 		hypnogram = self.export_hypnogram()
-		rem_cycles = self.calculate_rem_cycles()
+		rem_cycles = summary.get('rem_cycles', 0)
 
-		_, artifact_regions = self.artifact_processor.get_artifact_mask(self.raw)
 		artifact_count = len(artifact_regions)
 		artifact_duration = sum(r['duration'] for r in artifact_regions) / 60
 
@@ -861,7 +922,7 @@ class SleepAnalyzer:
 			'sleep_fragmentation_index': round(fragmentation.get('fragmentation_index', 0), 2),
 			'overall_sleep_quality': sleep_quality.get('overall_sleep_quality'),
 			'sleep_quality_status': sleep_quality.get('sleep_quality_status'),
-			'hypnogram_data': json.dumps(hypnogram) if hypnogram else None,
+			'hypnogram_data': json.dumps(hypnogram, separators=(',', ':')) if hypnogram else None,
 			'data_quality': 'good',
 			'analysis_notes': f"Автоматический анализ файла: {os.path.basename(edf_path)}",
 			'artifact_count': artifact_count,
@@ -871,18 +932,10 @@ class SleepAnalyzer:
 		return self.create_sql_update(sql_data, uuid, edf_path)
 
 	def create_sql_update(self, data, uuid, edf_path):
-		set_parts = []
-		for key, value in data.items():
-			if key in ['artifact_count', 'artifact_duration_minutes']:
-				continue
-
-			if value is None:
-				set_parts.append(f"`{key}` = NULL")
-			elif isinstance(value, str):
-				escaped = value.replace("'", "''")
-				set_parts.append(f"`{key}` = '{escaped}'")
-			else:
-				set_parts.append(f"`{key}` = {value}")
+		set_parts = [f"`{key}` = NULL" if value is None
+		             else f"`{key}` = '{value.replace(chr(39), chr(39) * 2)}'" if isinstance(value, str)
+		             else f"`{key}` = {value}"
+		             for key, value in data.items() if key not in _STUDY_COLUMNS]
 
 		sql = f"""-- SQL запрос для обновления статистики сна
 -- UUID исследования: {uuid}
@@ -933,8 +986,8 @@ class SQLGenerator:
 
 		edf_files = [os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.lower().endswith('.edf')]
 
-		with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-			results = list(executor.map(self.process_file, edf_files))
+		with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+			results = list(executor.map(_process_edf_file, edf_files, [self.config] * len(edf_files)))
 
 		valid_sql = [sql for sql in results if sql]
 
@@ -972,6 +1025,9 @@ class SQLGenerator:
 		print(f"Объединено {len(sql_files)} файлов в {output_file}")
 		return True
 
+def _process_edf_file(edf_path, config):
+	return SQLGenerator(config).process_file(edf_path)
+
 def main():
 	generator = SQLGenerator()
 	generator.generate_sql_files('EDF', 'sql_output')